@@ -1,8 +1,15 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+import hashlib
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
 
 # =========================
 # Page config
@@ -11,174 +18,300 @@ st.set_page_config(page_title="IDX Portfolio Rebalancing Simulator", layout="wid
 st.title("📈 IDX Close Price (1Y) + ⚖️ Rebalancing vs Buy & Hold Simulator")
 
 # =========================
-# User Input
+# Data
 # =========================
-tickers_input = st.text_area(
-    "Enter IDX tickers (2–5 tickers, one per line, without .JK)",
-    value="BBCA\nBMRI\nBBRI",
-    height=150
-)
-
-initial_equity = st.number_input("Initial Equity (IDR)", min_value=1_000_000, value=100_000_000, step=1_000_000)
-rebalance_period = st.number_input("Rebalancing Period (trading days)", min_value=5, value=20, step=5)
-
-tickers = [t.strip().upper() + ".JK" for t in tickers_input.splitlines() if t.strip()]
-tickers_clean = [t.replace(".JK", "") for t in tickers]
+logger = logging.getLogger(__name__)
+
+
+class PriceDataError(Exception):
+    pass
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_closes(tickers_tuple, as_of) -> pd.DataFrame:
+    # as_of only keys the cache so the trailing window rolls over daily
+    tickers = list(tickers_tuple)
+
+    try:
+        raw = yf.download(
+            tickers,
+            period="1y",
+            interval="1d",
+            group_by="column",
+            threads=True,
+            progress=False,
+            actions=False
+        )
+    except Exception:
+        logger.warning("Batch download failed for %s, retrying per ticker", tickers, exc_info=True)
+        raw = pd.DataFrame()
+
+    if raw.empty:
+        closes = {}
+    else:
+        batch = raw["Close"].reindex(columns=tickers)
+        closes = {t: batch[t] for t in tickers if not batch[t].isna().all()}
 
-# =========================
-# Date range
-# =========================
-end_date = datetime.today()
-start_date = end_date - timedelta(days=365)
+    # Fallback: yfinance reports a failed symbol as an all-NaN column, so
+    # only those tickers are re-fetched, concurrently
+    retry = [t for t in tickers if t not in closes]
+    if retry:
+        with ThreadPoolExecutor(max_workers=min(8, len(retry))) as ex:
+            results = dict(zip(retry, ex.map(_download_one, retry)))
 
-# =========================
-# Run
-# =========================
-if st.button("Run Simulation"):
+        for ticker, df in results.items():
+            if not df.empty:
+                closes[ticker] = df["Close"]
 
-    if not (2 <= len(tickers) <= 5):
-        st.warning("Please input between 2 and 5 tickers.")
-        st.stop()
+    return _check_closes(pd.DataFrame(closes).reindex(columns=tickers))
 
-    # =========================
-    # Fetch Prices
-    # =========================
-    price_data = {}
 
-    with st.spinner("Fetching data..."):
-        for ticker in tickers:
-            df = yf.download(ticker, start=start_date, end=end_date, progress=False)
+def _download_one(ticker) -> pd.DataFrame:
+    # Ticker.history builds its own frame, unlike yf.download which shares
+    # module-global state across calls. A failure comes back empty so
+    # _check_closes reports it like the batch path.
+    try:
+        df = yf.Ticker(ticker).history(period="1y", interval="1d", actions=False)
+    except Exception:
+        logger.warning("Download failed for %s", ticker, exc_info=True)
+        return pd.DataFrame()
 
-            if df.empty:
-                st.error(f"No data for {ticker}")
-                st.stop()
+    # Match the tz-naive dates of the batch download
+    if getattr(df.index, "tz", None) is not None:
+        df.index = df.index.tz_localize(None)
+    return df
 
-            if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.droplevel(1)
 
-            price_data[ticker.replace(".JK", "")] = df["Close"]
+def _check_closes(closes_df) -> pd.DataFrame:
+    # Raised rather than returned: st.cache_data does not cache exceptions,
+    # so a transient Yahoo outage is retried on the next run
+    missing = [t for t in closes_df.columns if closes_df[t].isna().all()]
+    if missing:
+        raise PriceDataError(f"No data for {', '.join(missing)}")
+    return closes_df
 
-    prices_df = pd.concat(price_data.values(), axis=1)
-    prices_df.columns = tickers_clean
-    prices_df = prices_df.dropna()
 
-    # =========================
-    # Price Chart
-    # =========================
-    fig_price = go.Figure()
-    for col in prices_df.columns:
-        fig_price.add_trace(go.Scatter(
-            x=prices_df.index,
-            y=prices_df[col],
+# =========================
+# Charts
+# =========================
+# Figures are keyed on a digest of the plotted arrays, dates included; the
+# underscored arguments are skipped by Streamlit's hasher.
+@st.cache_resource(max_entries=8)
+def build_price_fig(key, _x, _y_matrix, names) -> go.Figure:
+    fig = go.Figure()
+    for j, name in enumerate(names):
+        fig.add_trace(go.Scatter(
+            x=_x,
+            y=_y_matrix[:, j],
             mode="lines",
-            name=col,
+            name=name,
             hovertemplate='<b>%{fullData.name}</b><br>Date: %{x|%Y-%m-%d}<br>Price: IDR %{y:,.0f}<extra></extra>'
         ))
 
-    fig_price.update_layout(
+    fig.update_layout(
         title="Close Price – Last 1 Year",
         xaxis_title="Date",
         yaxis_title="Price (IDR)",
         hovermode="x unified",
         height=450
     )
-    st.plotly_chart(fig_price, use_container_width=True)
+    return fig
 
-    # =========================
-    # Rebalancing Simulation
-    # =========================
-    n_assets = len(tickers_clean)
-    target_weight = 1 / n_assets
 
-    shares_reb = {}
-    shares_hold = {}
+@st.cache_resource(max_entries=8)
+def build_equity_fig(key, _x, _reb_curve, _hold_curve) -> go.Figure:
+    fig = go.Figure()
 
-    equity_reb_curves = {t: [] for t in tickers_clean}
-    equity_hold_curves = {t: [] for t in tickers_clean}
+    fig.add_trace(go.Scatter(
+        x=_x,
+        y=_reb_curve,
+        mode="lines",
+        name="Portfolio (Rebalanced)",
+        line=dict(width=3)
+    ))
 
-    portfolio_reb_curve = []
-    portfolio_hold_curve = []
+    fig.add_trace(go.Scatter(
+        x=_x,
+        y=_hold_curve,
+        mode="lines",
+        name="Portfolio (Buy & Hold)",
+        line=dict(dash="dash")
+    ))
 
-    rebalance_log = []
+    fig.update_layout(
+        title="📊 Portfolio Equity Curve: Rebalancing vs Buy & Hold",
+        xaxis_title="Date",
+        yaxis_title="Equity (IDR)",
+        hovermode="x unified",
+        height=550
+    )
+    return fig
 
-    # Initial allocation
-    for t in tickers_clean:
-        alloc = initial_equity * target_weight
-        shares_reb[t] = alloc / prices_df.iloc[0][t]
-        shares_hold[t] = alloc / prices_df.iloc[0][t]
 
-    for i, date in enumerate(prices_df.index):
-        values_reb = {}
-        values_hold = {}
-        total_reb = 0
-        total_hold = 0
+# =========================
+# Simulation
+# =========================
+SIM_CACHE_DIR = Path(".sim_cache")
+SIM_CACHE_TTL = 24 * 3600
+SIM_ARRAYS = (
+    "equity_reb", "equity_hold", "portfolio_reb_curve", "portfolio_hold_curve",
+    "reb_idx", "vals_all", "drift_all", "transfer_all"
+)
 
-        for t in tickers_clean:
-            v_reb = shares_reb[t] * prices_df.iloc[i][t]
-            v_hold = shares_hold[t] * prices_df.iloc[i][t]
 
-            equity_reb_curves[t].append(v_reb)
-            equity_hold_curves[t].append(v_hold)
+# Results are memoized in-process and checkpointed to disk under `key`;
+# the price array is excluded from Streamlit's hasher since `key` covers it.
+@st.cache_data(ttl=SIM_CACHE_TTL, max_entries=32, show_spinner=False)
+def run_simulation(key, _prices, initial_equity, rebalance_period):
+    cache_path = SIM_CACHE_DIR / f"{key}.npz"
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as data:
+                return tuple(data[name] for name in SIM_ARRAYS)
+        except Exception:
+            logger.warning("Ignoring unreadable checkpoint %s", cache_path, exc_info=True)
+
+    P = _prices
+    T, n_assets = P.shape
+    target_weight = 1 / n_assets
+    alloc = initial_equity * target_weight
+
+    # Buy & hold: shares never change, so the curve is a single broadcast
+    shares_hold = alloc / P[0]
+    equity_hold = P * shares_hold
+    portfolio_hold_curve = equity_hold.sum(axis=1)
+
+    # Rebalanced: shares are constant between rebalance days, and the
+    # rebalance day itself is valued before trading
+    reb_idx = np.arange(rebalance_period, T, rebalance_period)
+    shares_reb = alloc / P[0]
+    equity_reb = np.empty_like(P)
+
+    lo = 0
+    for k in reb_idx:
+        np.multiply(P[lo:k + 1], shares_reb, out=equity_reb[lo:k + 1])
+        target_value = equity_reb[k].sum() * target_weight
+        shares_reb = target_value / P[k]
+        lo = k + 1
+
+    np.multiply(P[lo:], shares_reb, out=equity_reb[lo:])
+    portfolio_reb_curve = equity_reb.sum(axis=1)
+
+    # Rebalance log: equity on each rebalance day is the pre-trade value
+    vals_all = equity_reb[reb_idx]
+    target_all = portfolio_reb_curve[reb_idx, None] * target_weight
+    drift_all = (vals_all / target_all - 1) * 100
+    transfer_all = target_all - vals_all
+
+    result = (
+        equity_reb, equity_hold, portfolio_reb_curve, portfolio_hold_curve,
+        reb_idx, vals_all, drift_all, transfer_all
+    )
 
-            values_reb[t] = v_reb
-            values_hold[t] = v_hold
+    # The checkpoint is best-effort: a read-only or full disk only costs
+    # the next rerun a recompute
+    try:
+        SIM_CACHE_DIR.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=SIM_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            np.savez_compressed(f, **dict(zip(SIM_ARRAYS, result)))
+        Path(f.name).replace(cache_path)
+        _prune_sim_cache()
+    except OSError:
+        logger.warning("Could not checkpoint simulation to %s", cache_path, exc_info=True)
 
-            total_reb += v_reb
-            total_hold += v_hold
+    return result
 
-        portfolio_reb_curve.append(total_reb)
-        portfolio_hold_curve.append(total_hold)
 
-        if i > 0 and i % rebalance_period == 0:
-            target_value = total_reb * target_weight
-            log_row = {"Date": date.strftime("%Y-%m-%d")}
+def _prune_sim_cache():
+    # Checkpoints (and temp files left by failed writes) older than a day
+    # are dropped so the directory stays bounded
+    cutoff = time.time() - SIM_CACHE_TTL
+    for path in SIM_CACHE_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass  # already removed by a concurrent session
 
-            for t in tickers_clean:
-                drift_pct = (values_reb[t] / target_value - 1) * 100
-                transfer = target_value - values_reb[t]
 
-                log_row[f"{t} Equity (Before)"] = values_reb[t]
-                log_row[f"{t} Drift (%)"] = drift_pct
-                log_row[f"{t} Transfer"] = transfer
+# =========================
+# User Input
+# =========================
+tickers_input = st.text_area(
+    "Enter IDX tickers (2–5 tickers, one per line, without .JK)",
+    value="BBCA\nBMRI\nBBRI",
+    height=150
+)
 
-                shares_reb[t] = target_value / prices_df.iloc[i][t]
+initial_equity = st.number_input("Initial Equity (IDR)", min_value=1_000_000, value=100_000_000, step=1_000_000)
+rebalance_period = st.number_input("Rebalancing Period (trading days)", min_value=5, value=20, step=5)
 
-            rebalance_log.append(log_row)
+tickers = [t.strip().upper() + ".JK" for t in tickers_input.splitlines() if t.strip()]
+tickers_clean = [t.replace(".JK", "") for t in tickers]
 
-    equity_reb_df = pd.DataFrame(equity_reb_curves, index=prices_df.index)
-    equity_reb_df["Portfolio"] = portfolio_reb_curve
+# =========================
+# Date range
+# =========================
+end_date = datetime.today()
 
-    equity_hold_df = pd.DataFrame(equity_hold_curves, index=prices_df.index)
-    equity_hold_df["Portfolio"] = portfolio_hold_curve
+# =========================
+# Run
+# =========================
+if st.button("Run Simulation"):
+
+    if not (2 <= len(tickers) <= 5):
+        st.warning("Please input between 2 and 5 tickers.")
+        st.stop()
 
     # =========================
-    # Equity Curve Comparison Plot
+    # Fetch Prices
     # =========================
-    fig_equity = go.Figure()
+    try:
+        with st.spinner("Fetching data..."):
+            prices_df = fetch_closes(tuple(tickers), end_date.date())
+    except PriceDataError as e:
+        st.error(str(e))
+        st.stop()
 
-    fig_equity.add_trace(go.Scatter(
-        x=equity_reb_df.index,
-        y=equity_reb_df["Portfolio"],
-        mode="lines",
-        name="Portfolio (Rebalanced)",
-        line=dict(width=3)
-    ))
+    prices_df = prices_df.rename(columns=lambda c: c.replace(".JK", "")).dropna()
 
-    fig_equity.add_trace(go.Scatter(
-        x=equity_hold_df.index,
-        y=equity_hold_df["Portfolio"],
-        mode="lines",
-        name="Portfolio (Buy & Hold)",
-        line=dict(dash="dash")
-    ))
+    # =========================
+    # Price Chart
+    # =========================
+    P = prices_df.to_numpy(dtype=np.float64)
+    x_np = prices_df.index.to_numpy()
+    x_bytes = prices_df.index.asi8.tobytes()
 
-    fig_equity.update_layout(
-        title="📊 Portfolio Equity Curve: Rebalancing vs Buy & Hold",
-        xaxis_title="Date",
-        yaxis_title="Equity (IDR)",
-        hovermode="x unified",
-        height=550
-    )
+    price_key = hashlib.md5(x_bytes + P.tobytes()).digest()
+    fig_price = build_price_fig(price_key, x_np, P, tuple(tickers_clean))
+    st.plotly_chart(fig_price, use_container_width=True)
+
+    # =========================
+    # Rebalancing Simulation
+    # =========================
+    sim_key = hashlib.md5(
+        repr((tuple(tickers_clean), initial_equity, rebalance_period)).encode() + price_key
+    ).hexdigest()
+    (
+        equity_reb, equity_hold, portfolio_reb_curve, portfolio_hold_curve,
+        reb_idx, vals_all, drift_all, transfer_all
+    ) = run_simulation(sim_key, P, initial_equity, rebalance_period)
+    alloc = initial_equity / len(tickers_clean)
+
+    log_cols = {"Date": prices_df.index[reb_idx].strftime("%Y-%m-%d")}
+    for j, t in enumerate(tickers_clean):
+        log_cols[f"{t} Equity (Before)"] = vals_all[:, j]
+        log_cols[f"{t} Drift (%)"] = drift_all[:, j]
+        log_cols[f"{t} Transfer"] = transfer_all[:, j]
+    rebalance_df = pd.DataFrame(log_cols)
+
+    # =========================
+    # Equity Curve Comparison Plot
+    # =========================
+    equity_key = hashlib.md5(
+        x_bytes + portfolio_reb_curve.tobytes() + portfolio_hold_curve.tobytes()
+    ).digest()
+    fig_equity = build_equity_fig(equity_key, x_np, portfolio_reb_curve, portfolio_hold_curve)
     st.plotly_chart(fig_equity, use_container_width=True)
 
     # =========================
@@ -186,20 +319,12 @@ if st.button("Run Simulation"):
     # =========================
     st.subheader("🔄 Rebalancing History")
 
-    if rebalance_log:
-        rebalance_df = pd.DataFrame(rebalance_log)
-        rebalance_display = rebalance_df.copy()
-
-        money_cols = [c for c in rebalance_display.columns if "Equity" in c or "Transfer" in c]
-        pct_cols = [c for c in rebalance_display.columns if "Drift" in c]
+    if not rebalance_df.empty:
+        money_cols = [c for c in rebalance_df.columns if "Equity" in c or "Transfer" in c]
+        pct_cols = [c for c in rebalance_df.columns if "Drift" in c]
 
-        for col in money_cols:
-            rebalance_display[col] = rebalance_display[col].map(lambda x: f"{x:,.0f}")
-
-        for col in pct_cols:
-            rebalance_display[col] = rebalance_display[col].map(lambda x: f"{x:.2f}%")
-
-        st.dataframe(rebalance_display, use_container_width=True)
+        fmt = {c: "{:,.0f}" for c in money_cols} | {c: "{:.2f}%" for c in pct_cols}
+        st.dataframe(rebalance_df.style.format(fmt, na_rep="-"), use_container_width=True)
     else:
         st.info("No rebalancing events occurred.")
 
@@ -208,81 +333,45 @@ if st.button("Run Simulation"):
     # =========================
     st.subheader("📋 Summary (With Rebalancing)")
 
-    summary_reb_rows = []
-    for t in tickers_clean:
-        start_price = prices_df[t].iloc[0]
-        end_price = prices_df[t].iloc[-1]
-        price_growth_pct = (end_price / start_price - 1) * 100
-
-        final_equity = equity_reb_df[t].iloc[-1]
-        initial_alloc = initial_equity * target_weight
-        equity_growth_pct = (final_equity / initial_alloc - 1) * 100
-
-        summary_reb_rows.append({
-            "Ticker": t,
-            "Price Growth (1Y %)": price_growth_pct,
-            "Final Equity (IDR)": final_equity,
-            "Equity Growth (%)": equity_growth_pct
-        })
+    summary_fmt = {
+        "Price Growth (1Y %)": "{:.2f}%",
+        "Final Equity (IDR)": "{:,.0f}",
+        "Equity Growth (%)": "{:.2f}%"
+    }
 
-    portfolio_reb_growth_pct = (equity_reb_df["Portfolio"].iloc[-1] / initial_equity - 1) * 100
+    start_prices = P[0]
+    end_prices = P[-1]
+    price_growth = (end_prices / start_prices - 1) * 100
 
-    summary_reb_df = pd.DataFrame(summary_reb_rows)
-    portfolio_reb_row = pd.DataFrame([{
-        "Ticker": "PORTFOLIO (Rebalanced)",
-        "Price Growth (1Y %)": None,
-        "Final Equity (IDR)": equity_reb_df["Portfolio"].iloc[-1],
-        "Equity Growth (%)": portfolio_reb_growth_pct
-    }])
+    final_equity_reb = equity_reb[-1]
+    equity_growth_reb = (final_equity_reb / alloc - 1) * 100
+    portfolio_reb_growth_pct = (portfolio_reb_curve[-1] / initial_equity - 1) * 100
 
-    summary_reb_df = pd.concat([summary_reb_df, portfolio_reb_row], ignore_index=True)
+    summary_reb_df = pd.DataFrame({
+        "Ticker": tickers_clean + ["PORTFOLIO (Rebalanced)"],
+        "Price Growth (1Y %)": np.append(price_growth, np.nan),
+        "Final Equity (IDR)": np.append(final_equity_reb, portfolio_reb_curve[-1]),
+        "Equity Growth (%)": np.append(equity_growth_reb, portfolio_reb_growth_pct)
+    })
 
-    summary_reb_display = summary_reb_df.copy()
-    summary_reb_display["Final Equity (IDR)"] = summary_reb_display["Final Equity (IDR)"].map(lambda x: f"{x:,.0f}")
-    summary_reb_display["Price Growth (1Y %)"] = summary_reb_display["Price Growth (1Y %)"].map(lambda x: f"{x:.2f}%" if pd.notna(x) else "-")
-    summary_reb_display["Equity Growth (%)"] = summary_reb_display["Equity Growth (%)"].map(lambda x: f"{x:.2f}%")
-
-    st.dataframe(summary_reb_display, use_container_width=True)
+    st.dataframe(summary_reb_df.style.format(summary_fmt, na_rep="-"), use_container_width=True)
 
     # =========================
     # Buy & Hold Summary
     # =========================
     st.subheader("🧱 Buy & Hold (No Rebalancing) Summary")
 
-    summary_hold_rows = []
-    for t in tickers_clean:
-        start_price = prices_df[t].iloc[0]
-        end_price = prices_df[t].iloc[-1]
-        price_growth_pct = (end_price / start_price - 1) * 100
-
-        final_equity = equity_hold_df[t].iloc[-1]
-        initial_alloc = initial_equity * target_weight
-        equity_growth_pct = (final_equity / initial_alloc - 1) * 100
-
-        summary_hold_rows.append({
-            "Ticker": t,
-            "Price Growth (1Y %)": price_growth_pct,
-            "Final Equity (IDR)": final_equity,
-            "Equity Growth (%)": equity_growth_pct
-        })
-
-    portfolio_hold_growth_pct = (equity_hold_df["Portfolio"].iloc[-1] / initial_equity - 1) * 100
-
-    summary_hold_df = pd.DataFrame(summary_hold_rows)
-    portfolio_hold_row = pd.DataFrame([{
-        "Ticker": "PORTFOLIO (Buy & Hold)",
-        "Price Growth (1Y %)": None,
-        "Final Equity (IDR)": equity_hold_df["Portfolio"].iloc[-1],
-        "Equity Growth (%)": portfolio_hold_growth_pct
-    }])
-
-    summary_hold_df = pd.concat([summary_hold_df, portfolio_hold_row], ignore_index=True)
-
-    summary_hold_display = summary_hold_df.copy()
-    summary_hold_display["Final Equity (IDR)"] = summary_hold_display["Final Equity (IDR)"].map(lambda x: f"{x:,.0f}")
-    summary_hold_display["Price Growth (1Y %)"] = summary_hold_display["Price Growth (1Y %)"].map(lambda x: f"{x:.2f}%" if pd.notna(x) else "-")
-    summary_hold_display["Equity Growth (%)"] = summary_hold_display["Equity Growth (%)"].map(lambda x: f"{x:.2f}%")
-
-    st.dataframe(summary_hold_display, use_container_width=True)
+    final_equity_hold = equity_hold[-1]
+    equity_growth_hold = (final_equity_hold / alloc - 1) * 100
+    portfolio_hold_growth_pct = (portfolio_hold_curve[-1] / initial_equity - 1) * 100
+
+    summary_hold_df = pd.DataFrame({
+        "Ticker": tickers_clean + ["PORTFOLIO (Buy & Hold)"],
+        "Price Growth (1Y %)": np.append(price_growth, np.nan),
+        "Final Equity (IDR)": np.append(final_equity_hold, portfolio_hold_curve[-1]),
+        "Equity Growth (%)": np.append(equity_growth_hold, portfolio_hold_growth_pct)
+    })
+
+    st.dataframe(summary_hold_df.style.format(summary_fmt, na_rep="-"), use_container_width=True)
 
     st.success("Simulation completed: Rebalancing vs Buy & Hold comparison ready.")